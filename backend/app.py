@@ -1,15 +1,69 @@
 import os
-import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import json
+import asyncio
+import hashlib
+import tempfile
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 
-from core.rag import rag_engine
+from core.rag import rag_engine, DEFAULT_COLLECTION, SearchFilter, SearchOverloadedError, CollectionNotLoadedError
 from core.agents import debate_manager
+from core.events import status_channel
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 50 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_FORM_OVERHEAD = 64 * 1024 # multipart boundaries and the other form fields
+
+class UploadSizeLimitMiddleware:
+    """
+    Enforces the upload size limit while the body is being received. FastAPI parses (and spools)
+    the whole multipart body before the handler runs, so a check in the handler would only fire
+    after an oversized upload had been fully received.
+    """
+
+    def __init__(self, app, path: str, max_body_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        detail = f"Upload exceeds {UPLOAD_MAX_BYTES} bytes."
+        declared_size = int(dict(scope["headers"]).get(b"content-length") or 0)
+        if declared_size > self.max_body_bytes:
+            body = json.dumps({"detail": detail}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        # Chunked or under-declared bodies: abort body parsing as soon as the limit is crossed
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
 
 app = FastAPI(title="DEBATE CORE RAG API")
 
+# Added first so it sits inside CORS: early 413s still carry the CORS headers
+app.add_middleware(UploadSizeLimitMiddleware, path="/upload", max_body_bytes=UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD)
+
 # Allow CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -19,48 +73,208 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Index changes are pushed to /events subscribers instead of being polled
+rag_engine.add_status_listener(status_channel.publish)
+status_channel.publish(rag_engine.status)
+
+class QueryFilters(BaseModel):
+    sources: Optional[List[str]] = None
+    page_min: Optional[int] = None
+    page_max: Optional[int] = None
+    tags: Optional[List[str]] = None
+
 class QueryRequest(BaseModel):
     query: str
+    collections: Optional[List[str]] = None
+    filters: Optional[QueryFilters] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    collections: Optional[List[str]] = None
+    filters: Optional[QueryFilters] = None
+    concurrency: Optional[int] = None
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 1000))
+
+def _get_collection(name: str, create: bool = False):
+    try:
+        return rag_engine.get_collection(name, create=create)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown collection '{name}'.")
+
+async def _ensure_loaded(names: Optional[List[str]]):
+    # Validate target collections and load them outside the bounded search pool
+    for name in names or []:
+        col = _get_collection(name)
+        if not col.is_loaded:
+            await asyncio.to_thread(rag_engine.load_collection, name)
+
+def _sources(chunks):
+    # Deduplicated chunks cite every document they were found in
+    return sorted(set(ref['source'] for c in chunks for ref in c.get('sources') or [c]))
 
 @app.post("/query")
 async def process_query(request: QueryRequest):
-    # 1. Search knowledge base
-    context_chunks = rag_engine.search(request.query)
-    
+    # 0. Validate and load target collections up front
+    await _ensure_loaded(request.collections)
+
+    # 1. Search knowledge base (off the event loop, shed load when the search pool is saturated)
+    search_filter = SearchFilter(**request.filters.dict()) if request.filters else None
+    try:
+        context_chunks = await rag_engine.asearch(
+            request.query,
+            collections=request.collections,
+            search_filter=search_filter,
+            **debate_manager.retrieval_profile(request.query)
+        )
+    except SearchOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except CollectionNotLoadedError as e:
+        # Unloaded between validation and search
+        raise HTTPException(status_code=409, detail=f"{e} Load it and retry.")
+
     if not context_chunks:
         return {"error": "No relevant information found in the knowledge base."}
-    
+
     # 2. Conduct debate
     debate_results = await debate_manager.conduct_debate(request.query, context_chunks)
-    
+
     return {
         "query": request.query,
         "debate_rounds": debate_results,
-        "sources": list(set([c['source'] for c in context_chunks]))
+        "sources": _sources(context_chunks)
     }
 
+@app.post("/query/batch")
+async def process_query_batch(request: BatchQueryRequest):
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+    await _ensure_loaded(request.collections)
+
+    # 1. Shared retrieval: one encoder batch, one FAISS search per collection, duplicates collapsed
+    search_filter = SearchFilter(**request.filters.dict()) if request.filters else None
+    try:
+        canonical, contexts = await rag_engine.asearch_batch(
+            request.queries,
+            collections=request.collections,
+            search_filter=search_filter,
+            profiles=[debate_manager.retrieval_profile(q) for q in request.queries]
+        )
+    except SearchOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except CollectionNotLoadedError as e:
+        # Unloaded between validation and search
+        raise HTTPException(status_code=409, detail=f"{e} Load it and retry.")
+
+    # 2. Debates run through a bounded pool and are streamed back as NDJSON in completion order
+    async def stream():
+        async for i, rounds in debate_manager.conduct_batch(request.queries, contexts, canonical, request.concurrency):
+            line = {"index": i, "query": request.queries[i]}
+            if canonical[i] != i:
+                line["duplicate_of"] = canonical[i]
+            if rounds is None:
+                line["error"] = "No relevant information found in the knowledge base."
+            else:
+                line["debate_rounds"] = rounds
+                line["sources"] = _sources(contexts[i])
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/upload")
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(file: UploadFile = File(...), collection: str = Form(DEFAULT_COLLECTION), tags: str = Form("")):
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
-    
-    target_path = os.path.join("knowledge_base", file.filename)
-    with open(target_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Refresh index
-    rag_engine.refresh_index()
-    
-    return {"message": f"File '{file.filename}' uploaded and indexed successfully."}
 
-@app.get("/status")
-async def get_status():
+    col = _get_collection(collection, create=True)
+    os.makedirs(col.knowledge_dir, exist_ok=True)
+
+    # 1. UploadSizeLimitMiddleware has bounded the body while it was received and Starlette has
+    # spooled the file. Copy it next to the store in chunks, hashing as we go (bounded memory, no
+    # loop blocking). The check below is the exact per-file limit; the middleware also counts form overhead.
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=col.knowledge_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes.")
+                digest.update(chunk)
+                await asyncio.to_thread(buffer.write, chunk)
+
+        # 2. Atomic move into the content-addressed store; identical bytes are recognised here
+        try:
+            document = await asyncio.to_thread(
+                rag_engine.store_document,
+                col.name, tmp_path, digest.hexdigest(), os.path.basename(file.filename), size, tags.split(",")
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if document["duplicate"]:
+        # Same text, so the refresh is a cache hit that only reloads the merged tags for filtering
+        if document["tags_changed"]:
+            await asyncio.to_thread(rag_engine.refresh_index, collection=col.name)
+        return {
+            "message": f"File '{file.filename}' is identical to '{document['name']}', already indexed in '{col.name}'.",
+            "sha256": document["sha256"],
+            "tags": document["tags"],
+            "duplicate": True
+        }
+
+    # 3. Refresh index off the event loop
+    await asyncio.to_thread(rag_engine.refresh_index, collection=col.name)
+
     return {
-        "index_ready": rag_engine.index is not None,
-        "chunk_count": len(rag_engine.chunks),
-        "files_indexed": list(set([c['source'] for c in rag_engine.chunk_metadata])) if rag_engine.chunk_metadata else []
+        "message": f"File '{file.filename}' uploaded and indexed successfully in '{col.name}' as '{document['name']}'.",
+        "sha256": document["sha256"],
+        "tags": document["tags"],
+        "duplicate": False
     }
 
+@app.get("/collections")
+async def list_collections():
+    return {"collections": rag_engine.list_collections()}
+
+@app.post("/collections/{name}/load")
+async def load_collection(name: str):
+    _get_collection(name)
+    await asyncio.to_thread(rag_engine.load_collection, name)
+    return {"message": f"Collection '{name}' loaded."}
+
+@app.post("/collections/{name}/unload")
+async def unload_collection(name: str):
+    _get_collection(name)
+    rag_engine.unload_collection(name)
+    return {"message": f"Collection '{name}' unloaded."}
+
+@app.get("/status")
+async def get_status():
+    # Maintained incrementally by the RAG engine; no per-request work over the chunks
+    return rag_engine.status
+
+@app.get("/metrics")
+async def get_metrics():
+    return {"speculation": debate_manager.speculation_metrics()}
+
+@app.get("/events")
+async def status_events():
+    async def stream():
+        async for snapshot in status_channel.subscribe():
+            if snapshot is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,5 +1,8 @@
-from typing import List, Dict, Any
+import os
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from .llm import llm_provider
+from .local_engine import LocalRuleEngine
 
 class DebateAgent:
     def __init__(self, name: str, role: str, instruction: str):
@@ -7,7 +10,7 @@ class DebateAgent:
         self.role = role
         self.instruction = instruction
 
-    async def run(self, context: str, query: str, history: List[Dict[str, str]] = None) -> str:
+    def build_prompt(self, context: str, query: str, history: List[Dict[str, str]] = None) -> str:
         history_str = ""
         if history:
             history_str = "\n".join([f"{m['agent']}: {m['content']}" for m in history])
@@ -28,9 +31,22 @@ INSTRUCTION: {self.instruction}
 STRICT RULE: Answer ONLY for what is asked. Do not add conversational fillers. Do not add "hello" or "hope this helps". Just the facts.
 Provide your response according to your role. Be precise, use the context provided, and cite sources (PDF/TXT file names) when possible.
 """
-        return llm_provider.generate(prompt, system_instruction=self.instruction)
+        return prompt
+
+    async def run(self, context: str, query: str, history: List[Dict[str, str]] = None) -> str:
+        prompt = self.build_prompt(context, query, history)
+        # Provider SDKs are blocking: run them in a worker thread so concurrent debates overlap
+        return await asyncio.to_thread(llm_provider.generate, prompt, system_instruction=self.instruction)
 
 class DebateManager:
+    # top_k: max chunks kept, min_k: chunks kept before a score gap may cut the list. A gap of ~2
+    # means the next chunk matches one keyword fewer. The fetch depth is the engine's default for
+    # every intent: keyword re-scoring needs the wide pool to surface chunks like the fee tables.
+    RETRIEVAL_PROFILES = {
+        "Type A/B (Factual/Comparative)": {"top_k": 3, "min_k": 2, "score_gap": 1.5},
+        "Type C/D (Analytical/Strategic)": {"top_k": 6, "min_k": 3, "score_gap": 3.5},
+    }
+
     def __init__(self):
         # Base instructions are now dynamically adjusted in run based on intent, 
         # but we keep core identities here.
@@ -63,6 +79,21 @@ class DebateManager:
             "STEP 3 — CONTEXT: [Only if strict constraints/warnings apply]\n"
             "Do not add conversational text."
         )
+        # Offline mode: intent/evidence rules are compiled once here, not per query
+        self.local_engine = LocalRuleEngine.from_file()
+        # Upper bound on debates run at once by conduct_batch (tune to the provider's rate limits)
+        self.batch_concurrency = int(os.getenv("DEBATE_BATCH_CONCURRENCY", 4))
+
+        # Speculative mode starts the Synthesizer alongside the Judge (without the verdict in its
+        # history) and throws it away if the Judge rejects: ~one LLM latency saved on the happy path
+        self.speculative = os.getenv("DEBATE_SPECULATIVE", "").lower() in ("1", "true", "yes")
+        self.speculation_stats = {
+            "attempts": 0,
+            "hits": 0,
+            "misses": 0,
+            "wasted_prompt_tokens": 0,
+            "wasted_completion_tokens": 0,
+        }
 
     def classify_intent(self, query: str) -> str:
         # Simple keyword-based classifier for this constrained environment
@@ -71,8 +102,15 @@ class DebateManager:
             return "Type A/B (Factual/Comparative)"
         return "Type C/D (Analytical/Strategic)"
 
+    def retrieval_profile(self, query: str) -> Dict[str, Any]:
+        """Search depth for a query: narrow factual questions need few chunks, analytical ones more."""
+        return dict(self.RETRIEVAL_PROFILES[self.classify_intent(query)])
+
     async def conduct_debate(self, query: str, context_chunks: List[Dict[str, Any]]):
-        context_text = "\n---\n".join([f"Source: {c['source']}\nContent: {c['content']}" for c in context_chunks])
+        context_text = "\n---\n".join([
+            f"Source: {', '.join(dict.fromkeys(r['source'] for r in c.get('sources') or [c]))}\nContent: {c['content']}"
+            for c in context_chunks
+        ])
         
         intent = self.classify_intent(query)
         print(f"--- Intent Classified: {intent} ---")
@@ -99,8 +137,22 @@ class DebateManager:
                 rounds.append({"agent": "Agent_Pro", "content": pro_res})
                 rounds.append({"agent": "Agent_Contra", "content": contra_res})
                 
+                # Speculative Synthesizer races the Judge on the same Pro/Contra history
+                speculation = None
+                if self.speculative:
+                    self.speculation_stats["attempts"] += 1
+                    speculation = asyncio.ensure_future(
+                        self.agent_synthesizer.run(context_with_intent, query, history=list(rounds))
+                    )
+
                 # Judge evaluates
-                judge_response = await self.agent_judge.run(context_with_intent, query, history=rounds)
+                try:
+                    judge_response = await self.agent_judge.run(context_with_intent, query, history=rounds)
+                except BaseException:
+                    # Failure or cancellation: still account for the speculation and retrieve its result
+                    if speculation is not None:
+                        self._discard_speculation(speculation, context_with_intent, query, rounds[:2])
+                    raise
                 rounds.append({"agent": "Agent_Judge", "content": judge_response})
                 
                 score = self._extract_score(judge_response)
@@ -108,189 +160,98 @@ class DebateManager:
                 
                 if score >= 6:
                     # Synthesizer produces final formatted output
-                    synthesis = await self.agent_synthesizer.run(context_with_intent, query, history=rounds)
+                    if speculation is not None:
+                        try:
+                            synthesis = await speculation
+                        except BaseException:
+                            self.speculation_stats["misses"] += 1
+                            raise
+                    else:
+                        synthesis = await self.agent_synthesizer.run(context_with_intent, query, history=rounds)
                     rounds.append({"agent": "Agent_Synthesizer", "content": synthesis})
                     
                     # Final check: Does synthesis contain the answer?
                     if "STEP 1" not in synthesis and "Final Answer" not in synthesis:
+                         if speculation is not None:
+                             self._discard_speculation(speculation, context_with_intent, query, rounds[:2])
                          print("Synthesis format failed. Retrying...")
                          query += " (SYSTEM ERROR: You failed to follow the output format. USE 'STEP 1 — DIRECT ANSWER'.)"
                          continue
                         
+                    # Only a speculative synthesis that is actually returned counts as a hit
+                    if speculation is not None:
+                        self.speculation_stats["hits"] += 1
                     return rounds
                 else:
+                    if speculation is not None:
+                        self._discard_speculation(speculation, context_with_intent, query, rounds[:2])
                     print(f"Score {score} too low. Restarting debate...")
                     query = f"{query} (Note: Previous attempt failed to answer specifically. Calculate numbers if asked.)"
 
-        # 2. LOCAL THEATRICAL DEBATE (No API Key) - LOGIC ADAPTED FOR TEXT FILES
-        rounds = []
-        
-        # Determine strict logic even for local theater
-        q_lower = query.lower()
-        is_cost = any(k in q_lower for k in ["cost", "price", "fee", "tuition", "much"])
-        is_job = any(k in q_lower for k in ["job", "work", "career", "placement", "civil"])
-        is_scholarship = any(k in q_lower for k in ["scholarship", "bourse", "merit"])
-        is_housing = any(k in q_lower for k in ["housing", "dorm", "accommodation", "living", "campus"])
-        is_abroad = any(k in q_lower for k in ["abroad", "international", "exchange", "double degree", "visa"])
-        
-        pro_content = "Information not found."
-        pro_source = "Documents"
-        contra_content = "No contradictions found."
-        synthesis_content = "Unable to synthesize."
-        
-        if is_cost:
-            # --- COST LOGIC ---
-            found_master = False
-            for c in context_chunks:
-                if "master" in c['source'].lower() and ("55,000" in c['content'] or "frais" in c['content'].lower()):
-                    pro_content = c['content']
-                    pro_source = c['source']
-                    found_master = True
-                    break
-            
-            if not found_master:
-                for c in context_chunks:
-                    if "55,000" in c['content']:
-                        pro_content = c['content']
-                        pro_source = c['source']
-                        break
+        # 2. LOCAL THEATRICAL DEBATE (No API Key) - driven by the compiled rule table
+        return self.local_engine.debate(query, context_chunks)
 
-            for c in context_chunks:
-                if "hidden cost" in c['content'].lower():
-                    contra_content = c['content']
-                    break
+    async def conduct_batch(self, queries: List[str], contexts: List[List[Dict[str, Any]]],
+                            canonical: Optional[List[int]] = None,
+                            concurrency: Optional[int] = None) -> AsyncIterator[Tuple[int, Optional[List[Dict[str, str]]]]]:
+        """
+        Runs one debate per distinct query through a bounded pool and yields `(index, rounds)` in
+        completion order. `canonical[i]` names the query whose debate answers query i (see
+        RAGEngine.search_batch); duplicates are emitted as soon as their representative finishes.
+        Queries without context yield `None` rounds.
+        """
+        canonical = canonical or list(range(len(queries)))
+        limit = max(1, min(concurrency or self.batch_concurrency, self.batch_concurrency))
+        semaphore = asyncio.Semaphore(limit)
 
-            synthesis_content = (
-                "STEP 1 — DIRECT ANSWER:\n"
-                "The total estimated cost for Computer Engineering is approx. 68,300 MAD.\n\n"
-                "STEP 2 — BREAKDOWN:\n"
-                "- Tuition: 55,000 MAD\n"
-                "- Registration: 5,000 MAD\n"
-                "- Insurance/Library: 1,300 MAD\n"
-                "- AI Lab Fee: 5,000 MAD (Hidden)\n"
-                "- Cloud Sub: ~2,000 MAD (Hidden)\n\n"
-                "STEP 3 — CONTEXT:\n"
-                "Mandatory hidden fees apply."
-            )
+        members: Dict[int, List[int]] = {}
+        for i, rep in enumerate(canonical):
+            members.setdefault(rep, []).append(i)
 
-        elif is_job:
-            # --- JOB LOGIC ---
-            for c in context_chunks:
-                if "section 7" in c['content'].lower() or "partnerships" in c['content'].lower():
-                    pro_content = c['content']
-                    pro_source = c['source']
-                    break
-            for c in context_chunks:
-                if "real placement stats" in c['content'].lower() or "disparity" in c['content'].lower():
-                    contra_content = c['content']
-                    break
-            
-            synthesis_content = (
-                "STEP 1 — DIRECT ANSWER:\n"
-                "40% placement in Casablanca, vs 100% in Fes.\n\n"
-                "STEP 2 — BREAKDOWN:\n"
-                "- Fes-Meknes: 100% Placement (High Demand)\n"
-                "- Casablanca: 40% Placement (High Competition)\n\n"
-                "STEP 3 — CONTEXT:\n"
-                "UPF graduates face stiff competition from EMI/EHTP in Casablanca. Mandatory internships are often unpaid."
-            )
+        async def run(rep: int):
+            if not contexts[rep]:
+                return rep, None
+            async with semaphore:
+                return rep, await self.conduct_debate(queries[rep], contexts[rep])
 
-        elif is_scholarship:
-            # --- SCHOLARSHIP LOGIC ---
-            for c in context_chunks:
-                if "section 9" in c['content'].lower() or "merit" in c['content'].lower():
-                    pro_content = c['content']
-                    pro_source = c['source']
-                    break
-            for c in context_chunks:
-                if "article 12" in c['content'].lower() or "cancelled" in c['content'].lower():
-                    contra_content = c['content']
-                    break
-            
-            synthesis_content = (
-                "STEP 1 — DIRECT ANSWER:\n"
-                "No, it is not guaranteed. It can be cancelled immediately.\n\n"
-                "STEP 2 — CONDITIONS:\n"
-                "- Requirement: Annual average > 12/20.\n"
-                "- Penalty: Cancellation if average drops.\n"
-                "- Risk: Permanently lost if year is repeated.\n\n"
-                "STEP 3 — CONTEXT:\n"
-                "This 'Article 12' rule is strictly enforced."
-            )
+        tasks = [asyncio.ensure_future(run(rep)) for rep in members]
+        try:
+            for task in asyncio.as_completed(tasks):
+                rep, rounds = await task
+                for i in members[rep]:
+                    yield i, rounds
+        finally:
+            # The consumer may stop early (e.g. the HTTP client disconnected): stop spending
+            # provider calls on debates nobody will read
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
 
-        elif is_housing:
-            # --- HOUSING LOGIC ---
-            for c in context_chunks:
-                if "section 10" in c['content'].lower() or "on-campus" in c['content'].lower():
-                    pro_content = c['content']
-                    pro_source = c['source']
-                    break
-            for c in context_chunks:
-                if "housing reality" in c['content'].lower() or "availability crisis" in c['content'].lower():
-                    contra_content = c['content']
-                    break
-            
-            synthesis_content = (
-                "STEP 1 — DIRECT ANSWER:\n"
-                "Only 150 spots availalble for 600 students. Not guaranteed.\n\n"
-                "STEP 2 — BREAKDOWN:\n"
-                "- Availability: 25% of class only (First come, first served).\n"
-                "- Hidden Cost: Electricity ~400 MAD/month (Not included).\n"
-                "- Transport: Shuttle limited; Taxis cost ~1500 MAD/month.\n\n"
-                "STEP 3 — CONTEXT:\n"
-                "Gym access is restricted to off-peak hours."
-            )
+    def _discard_speculation(self, speculation: asyncio.Future, context: str, query: str,
+                             history: List[Dict[str, str]]):
+        """Records a rejected speculative synthesis; its completion is counted once it lands."""
+        self.speculation_stats["misses"] += 1
+        prompt = self.agent_synthesizer.build_prompt(context, query, history)
+        self.speculation_stats["wasted_prompt_tokens"] += self._estimate_tokens(prompt)
 
-        elif is_abroad:
-            # --- STUDY ABROAD LOGIC ---
-            for c in context_chunks:
-                if "section 11" in c['content'].lower() or "mobility" in c['content'].lower():
-                    pro_content = c['content']
-                    pro_source = c['source']
-                    break
-            
-            # Fix: Explicitly look for the negative internal memo data
-            for c in context_chunks:
-                if "double degree myth" in c['content'].lower() or "eligibility restriction" in c['content'].lower() or "visa issues" in c['content'].lower():
-                    contra_content = c['content']
-                    break
-            
-            synthesis_content = (
-                "STEP 1 — DIRECT ANSWER:\n"
-                "Restricted to Top 5% of students only. Costs are double.\n\n"
-                "STEP 2 — BREAKDOWN:\n"
-                "- Eligibility: Top 5% academic performance only.\n"
-                "- Cost: Must pay tuition to BOTH UPF and Partner Uni.\n"
-                "- Risk: 30% Visa rejection rate.\n\n"
-                "STEP 3 — CONTEXT:\n"
-                "The 'Double Degree' is an elite track, not a standard option."
-            )
-        
-        else:
-            # --- FALLBACK ---
-            pro_content = "Documents available."
-            contra_content = "Please ask about Costs, Jobs, Scholarships, Housing, or Study Abroad."
-            synthesis_content = "Please refine your question."
+        def record_completion(task: asyncio.Future):
+            # The provider call runs in a thread and cannot be interrupted, so let it finish
+            if not task.cancelled() and task.exception() is None:
+                self.speculation_stats["wasted_completion_tokens"] += self._estimate_tokens(task.result())
+
+        speculation.add_done_callback(record_completion)
 
-        rounds.append({
-            "agent": "Agent_Pro",
-            "content": f"Direct Answer based on {pro_source}:\n"
-                       f"The official data states:\n\n{pro_content}\n\nI confirm the positive outlook."
-        })
-        rounds.append({
-            "agent": "Agent_Contra",
-            "content": f"WAIT! You missed the 'Internal Confidential' data:\n\n{contra_content}\n\nThe reality is different."
-        })
-        rounds.append({
-            "agent": "Agent_Judge",
-            "content": f"Evaluation: Pro cited official brochure. Contra cited internal HR/Finance memos.\nScore: 9/10."
-        })
-        rounds.append({
-            "agent": "Agent_Synthesizer",
-            "content": synthesis_content
-        })
+    def speculation_metrics(self) -> Dict[str, Any]:
+        stats = dict(self.speculation_stats)
+        decided = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / decided, 4) if decided else None
+        stats["enabled"] = self.speculative
+        return stats
 
-        return rounds
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        # Providers do not report usage through llm_provider; ~4 characters per token is close enough
+        return len(text or "") // 4
 
     def _extract_score(self, text: str) -> float:
         import re
@@ -0,0 +1,88 @@
+import re
+import zlib
+import numpy as np
+from typing import Dict, List
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_FIGURE = re.compile(r"\d[\d.,]*")
+
+
+class MinHashDeduplicator:
+    """
+    Near-duplicate detection over word shingles with MinHash + LSH banding.
+
+    LSH candidates are only merged into an earlier representative after an exact check: the
+    texts must carry the same figures (numeric tokens, in order) and their exact shingle Jaccard
+    must reach `threshold`. Two fee tables differing by one amount are therefore never collapsed,
+    since the dropped text would become unretrievable. Only representatives are indexed in the
+    LSH buckets, so similarity never chains through intermediate texts.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, bands: int = 32,
+                 shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        # a * h + b stays below 2**64 because hashes, a and b are all 32-bit
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def _shingles(self, text: str) -> set:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < self.shingle_size:
+            grams = {" ".join(words)}
+        else:
+            grams = {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+    def signature(self, text: str, shingles: set = None) -> np.ndarray:
+        hashes = np.fromiter(shingles if shingles is not None else self._shingles(text), dtype=np.uint64)
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def _jaccard(a: set, b: set) -> float:
+        return len(a & b) / len(a | b) if a or b else 1.0
+
+    def group(self, texts: List[str]) -> List[int]:
+        """Returns, for each text, the index of the representative it collapses into (itself if unique)."""
+        canonical = list(range(len(texts)))
+        signatures, shingle_sets, figures = [], [], []
+        buckets: Dict[tuple, List[int]] = {}
+
+        for i, text in enumerate(texts):
+            shingles = self._shingles(text)
+            sig = self.signature(text, shingles)
+            signatures.append(sig)
+            shingle_sets.append(shingles)
+            figures.append(_FIGURE.findall(text))
+            keys = [(band, sig[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+            match = None
+            checked = set()
+            for key in keys:
+                for rep in buckets.get(key, ()):
+                    if rep in checked:
+                        continue
+                    checked.add(rep)
+                    # MinHash only proposes candidates; the merge decision is exact
+                    if np.mean(signatures[rep] == sig) >= self.threshold and figures[rep] == figures[i] \
+                            and self._jaccard(shingle_sets[rep], shingles) >= self.threshold:
+                        match = rep
+                        break
+                if match is not None:
+                    break
+
+            if match is None:
+                for key in keys:
+                    buckets.setdefault(key, []).append(i)
+            else:
+                canonical[i] = match
+        return canonical
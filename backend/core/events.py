@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+class StatusChannel:
+    """
+    Latest-value broadcast channel for status snapshots.
+
+    Publishers (possibly worker threads) replace the current snapshot and wake subscribers.
+    Subscribers always receive the most recent snapshot, so bursts of updates are coalesced and
+    idle clients cost nothing until something changes.
+    """
+
+    def __init__(self, keepalive_seconds: float = 30.0):
+        self.keepalive_seconds = keepalive_seconds
+        self._latest: Optional[Dict[str, Any]] = None
+        self._generation = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        if self._loop is None:
+            self._loop = loop
+            self._changed = asyncio.Event()
+
+    def publish(self, snapshot: Dict[str, Any]):
+        """Thread-safe: may be called from the event loop or any worker thread."""
+        self._latest = snapshot
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self._generation += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yields the current snapshot, then each newer one. Yields None as a keepalive tick."""
+        self.bind(asyncio.get_running_loop())
+        seen = -1
+        while True:
+            if seen != self._generation:
+                seen = self._generation
+                yield self._latest
+                continue
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self.keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield None
+
+
+# Singleton instance
+status_channel = StatusChannel()
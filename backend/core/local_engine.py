@@ -0,0 +1,119 @@
+import os
+import re
+import json
+from typing import List, Dict, Any, Optional, Tuple
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_rules.json")
+
+
+def _any_substring(patterns: List[str]) -> re.Pattern:
+    """Zero-width alternation so overlapping literals are all visited in a single scan."""
+    ordered = sorted(set(patterns), key=len, reverse=True)
+    return re.compile("(?=(" + "|".join(re.escape(p) for p in ordered) + "))")
+
+
+class _Tier:
+    """One evidence pattern: optional source substrings AND any of the content substrings."""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.sources = [s.lower() for s in spec.get("source", [])]
+        self.content = [c.lower() for c in spec.get("content", [])]
+
+    def matches(self, source: str, found: set) -> bool:
+        if self.sources and not any(s in source for s in self.sources):
+            return False
+        return not self.content or bool(found.intersection(self.content))
+
+
+class _CompiledIntent:
+    def __init__(self, spec: Dict[str, Any]):
+        self.name = spec["name"]
+        self.keywords = [k.lower() for k in spec["keywords"]]
+        self.pro = [_Tier(t) for t in spec.get("pro", [])]
+        self.contra = [_Tier(t) for t in spec.get("contra", [])]
+        self.synthesis = spec["synthesis"]
+
+        patterns = sorted({p for tier in self.pro + self.contra for p in tier.content}, key=len, reverse=True)
+        self.evidence_regex = _any_substring(patterns) if patterns else None
+        # The scan reports the longest literal starting at each offset; shorter literals that it
+        # contains are implied, which keeps the single pass exact for overlapping patterns
+        self.implied = {p: {q for q in patterns if q in p} for p in patterns}
+
+    def scan(self, chunks: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """One pass over the chunks, returning the best (pro, contra) evidence by tier then order."""
+        best = {"pro": (len(self.pro), None), "contra": (len(self.contra), None)}
+        for chunk in chunks:
+            found = set()
+            if self.evidence_regex is not None:
+                for m in self.evidence_regex.finditer(chunk["content"].lower()):
+                    found |= self.implied[m.group(1)]
+            source = chunk["source"].lower()
+
+            for role, tiers in (("pro", self.pro), ("contra", self.contra)):
+                rank = best[role][0]
+                for t in range(rank):
+                    if tiers[t].matches(source, found):
+                        best[role] = (t, chunk)
+                        break
+        return best["pro"][1], best["contra"][1]
+
+
+class LocalRuleEngine:
+    """Offline debate driven by a declarative intent table, compiled once at startup."""
+
+    def __init__(self, rules: Dict[str, Any]):
+        self.rounds = rules["rounds"]
+        self.defaults = rules["defaults"]
+        self.fallback = rules["fallback"]
+        self.intents = [_CompiledIntent(spec) for spec in rules["intents"]]
+
+        # A single zero-width alternation over every keyword; the group index is the intent rank
+        # so the earliest-declared intent wins, exactly like the former if/elif chain
+        alternatives = []
+        for i, intent in enumerate(self.intents):
+            ordered = sorted(intent.keywords, key=len, reverse=True)
+            alternatives.append(f"(?P<i{i}>" + "|".join(re.escape(k) for k in ordered) + ")")
+        self.intent_regex = re.compile("(?=" + "|".join(alternatives) + ")") if alternatives else None
+
+    @classmethod
+    def from_file(cls, path: str = None) -> "LocalRuleEngine":
+        path = path or os.getenv("LOCAL_RULES_PATH") or DEFAULT_RULES_PATH
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def classify(self, query: str) -> Optional[_CompiledIntent]:
+        if self.intent_regex is None:
+            return None
+        rank = None
+        for m in self.intent_regex.finditer(query.lower()):
+            i = int(m.lastgroup[1:])
+            if rank is None or i < rank:
+                rank = i
+                if rank == 0:
+                    break
+        return self.intents[rank] if rank is not None else None
+
+    def debate(self, query: str, context_chunks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        pro_content = self.defaults["pro_content"]
+        pro_source = self.defaults["pro_source"]
+        contra_content = self.defaults["contra_content"]
+
+        intent = self.classify(query)
+        if intent is None:
+            pro_content = self.fallback["pro_content"]
+            contra_content = self.fallback["contra_content"]
+            synthesis_content = self.fallback["synthesis"]
+        else:
+            pro, contra = intent.scan(context_chunks)
+            if pro is not None:
+                pro_content, pro_source = pro["content"], pro["source"]
+            if contra is not None:
+                contra_content = contra["content"]
+            synthesis_content = intent.synthesis
+
+        return [
+            {"agent": "Agent_Pro", "content": self.rounds["pro"].format(source=pro_source, content=pro_content)},
+            {"agent": "Agent_Contra", "content": self.rounds["contra"].format(content=contra_content)},
+            {"agent": "Agent_Judge", "content": self.rounds["judge"]},
+            {"agent": "Agent_Synthesizer", "content": synthesis_content},
+        ]
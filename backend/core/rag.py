@@ -1,36 +1,252 @@
 import os
+import re
+import json
+import asyncio
+import functools
+import threading
 import numpy as np
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+
+from .dedup import MinHashDeduplicator
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+
+DEFAULT_COLLECTION = "default"
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+MANIFEST_FILE = "manifest.json"
+PAGE_BREAK = "\f"
+ENCODE_PROGRESS_STEP = 256
+# Bumped whenever the cached chunk layout changes so stale caches are rebuilt
+INDEX_FORMAT = 3
+
+
+class SearchOverloadedError(RuntimeError):
+    """Raised when the search pool queue is full; callers should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Search capacity exhausted, retry later.")
+        self.retry_after = retry_after
+
+
+class CollectionNotLoadedError(RuntimeError):
+    """Raised when a search explicitly names a collection that has documents but is not loaded."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Collection '{name}' is not loaded.")
+        self.name = name
+
+
+@dataclass
+class SearchFilter:
+    """Metadata predicates applied inside the FAISS search. Unset fields do not constrain."""
+    sources: Optional[List[str]] = None
+    page_min: Optional[int] = None
+    page_max: Optional[int] = None
+    tags: Optional[List[str]] = None  # matches chunks whose source carries ANY of these tags
+
+    def is_empty(self) -> bool:
+        return not (self.sources or self.tags or self.page_min is not None or self.page_max is not None)
+
+
+class Collection:
+    """A named partition of the knowledge base with its own directory, FAISS index and metadata cache."""
+
+    def __init__(self, name: str, knowledge_dir: str, index_path: str, metadata_path: str):
+        self.name = name
+        self.knowledge_dir = knowledge_dir
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+
+        self.index = None
+        self.chunks = []
+        self.chunk_metadata = []
+
+        # `lock` guards the swap of the in-memory state, `build_lock` serialises (re)builds
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.manifest_lock = threading.Lock()
+
+        # Columnar view of chunk metadata used to build FAISS ID selectors: one entry per
+        # (row, origin) so a chunk can be matched through any of the documents it came from
+        self.ref_rows = np.empty(0, dtype='int64')
+        self.ref_sources = np.empty(0, dtype='int32')
+        self.ref_pages = np.empty(0, dtype='int32')
+        self.source_codes: Dict[str, int] = {}
+        self.source_tags: Dict[str, List[str]] = {}
+        self.files_indexed: List[str] = []
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.index is not None
+
+    @property
+    def has_documents(self) -> bool:
+        return os.path.isdir(self.knowledge_dir) and any(f.endswith('.txt') for f in os.listdir(self.knowledge_dir))
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.knowledge_dir, MANIFEST_FILE)
+
+    def read_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading manifest {self.manifest_path}: {e}")
+            return {}
+
+    def write_manifest(self, manifest: Dict[str, Dict[str, Any]]):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def install(self, index, chunks: List[str], chunk_metadata: List[Dict[str, Any]]):
+        """Swaps in a freshly built or loaded index and precomputes the filter columns."""
+        source_codes = {}
+        rows, sources, pages = [], [], []
+        for row, meta in enumerate(chunk_metadata):
+            # Collapsed near-duplicates keep back-references to every original location
+            for ref in meta.get("sources") or [meta]:
+                code = source_codes.setdefault(ref["source"], len(source_codes))
+                rows.append(row)
+                sources.append(code)
+                pages.append(ref.get("page", 1))
+
+        # Tags are keyed by the document name shown in results (content-addressed files have one)
+        source_tags = {
+            entry.get("name", key): [t.lower() for t in entry.get("tags", [])]
+            for key, entry in self.read_manifest().items()
+        }
+
+        with self.lock:
+            self.source_codes = source_codes
+            self.source_tags = source_tags
+            self.files_indexed = sorted(source_codes)
+            self.ref_rows = np.array(rows, dtype='int64')
+            self.ref_sources = np.array(sources, dtype='int32')
+            self.ref_pages = np.array(pages, dtype='int32')
+            self.index = index
+            self.chunks = chunks
+            self.chunk_metadata = chunk_metadata
+
+    def snapshot(self, search_filter: Optional["SearchFilter"] = None):
+        """
+        Returns a consistent (index, chunk_metadata, row_ids, ref_filter) view for a search thread.
+        `ref_filter` tells which back-references of a hit satisfied the filter (None if unfiltered).
+        """
+        with self.lock:
+            return self.index, self.chunk_metadata, self.select(search_filter), self.ref_filter(search_filter)
+
+    def _allowed_sources(self, search_filter: SearchFilter) -> Optional[set]:
+        allowed_sources = None
+        if search_filter.sources:
+            allowed_sources = set(search_filter.sources)
+        if search_filter.tags:
+            wanted = {t.lower() for t in search_filter.tags}
+            tagged = {s for s, tags in self.source_tags.items() if wanted.intersection(tags)}
+            allowed_sources = tagged if allowed_sources is None else allowed_sources & tagged
+        return allowed_sources
+
+    def ref_filter(self, search_filter: Optional[SearchFilter]):
+        """Predicate over single back-references, mirroring `select` row by row."""
+        if search_filter is None or search_filter.is_empty():
+            return None
+        allowed_sources = self._allowed_sources(search_filter)
+        page_min, page_max = search_filter.page_min, search_filter.page_max
+
+        def matches(ref: Dict[str, Any]) -> bool:
+            page = ref.get("page", 1)
+            return (allowed_sources is None or ref["source"] in allowed_sources) \
+                and (page_min is None or page >= page_min) \
+                and (page_max is None or page <= page_max)
+        return matches
+
+    def select(self, search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """Returns the sorted row ids matching the filter, or None when nothing is filtered."""
+        if search_filter is None or search_filter.is_empty():
+            return None
+
+        match = np.ones(len(self.ref_rows), dtype=bool)
+
+        allowed_sources = self._allowed_sources(search_filter)
+        if allowed_sources is not None:
+            codes = [self.source_codes[s] for s in allowed_sources if s in self.source_codes]
+            match &= np.isin(self.ref_sources, codes)
+
+        if search_filter.page_min is not None:
+            match &= self.ref_pages >= search_filter.page_min
+        if search_filter.page_max is not None:
+            match &= self.ref_pages <= search_filter.page_max
+
+        return np.unique(self.ref_rows[match])
+
+    def unload(self):
+        """Drops the in-memory index. The on-disk cache is kept so reloading stays instant."""
+        self.install(None, [], [])
+
 
 class RAGEngine:
     def __init__(self, model_name: str = "paraphrase-multilingual-MiniLM-L12-v2", knowledge_dir: str = None):
         # Determine strict absolute path to knowledge_base
-        current_file_dir = os.path.dirname(os.path.abspath(__file__)) 
+        current_file_dir = os.path.dirname(os.path.abspath(__file__))
         project_root = os.path.abspath(os.path.join(current_file_dir, "..", ".."))
         self.knowledge_dir = os.path.join(project_root, "knowledge_base")
         self.model_name = model_name
         self._model = None
+        self._model_lock = threading.Lock()
         self._faiss = None
-            
+
+        # Encoding and FAISS scans release the GIL, so a CPU-sized pool runs them truly in parallel.
+        # Requests beyond workers + queue limit are rejected instead of piling up latency.
+        self.search_workers = int(os.getenv("RAG_SEARCH_WORKERS", os.cpu_count() or 1))
+        self.search_queue_limit = int(os.getenv("RAG_SEARCH_QUEUE_LIMIT", self.search_workers * 4))
+        self.search_retry_after = int(os.getenv("RAG_SEARCH_RETRY_AFTER", 1))
+
+        # Near-duplicate chunks (overlaps, repeated headers and fee tables) are collapsed at ingest
+        self.deduplicator = MinHashDeduplicator(threshold=float(os.getenv("RAG_DEDUP_THRESHOLD", 0.85)))
+        self._search_executor = ThreadPoolExecutor(max_workers=self.search_workers, thread_name_prefix="rag-search")
+        self._search_inflight = 0
+
+        # Status is maintained incrementally and pushed to listeners; it is never recomputed per read
+        self.index_version = 0
+        self.indexing: Dict[str, Dict[str, Any]] = {}
+        self.status: Dict[str, Any] = {}
+        self._status_lock = threading.Lock()
+        self._status_listeners = []
+
         print(f"--- [DEBATE CORE] RAG SYSTEM STARTUP ---")
         print(f"Targeting Knowledge Base: {self.knowledge_dir}")
-        
-        self.index = None
-        self.chunks = []
-        self.chunk_metadata = []
-        
-        self.index_path = os.path.join(project_root, "backend", "faiss_index.bin")
-        self.metadata_path = os.path.join(project_root, "backend", "metadata.pkl")
-        
-        # Initialize index (will be fast if cache exists)
-        self.refresh_index()
+
+        # Named collections live in their own directories; each one gets its own index cache
+        self.collections_dir = os.path.join(project_root, "collections")
+        self.indexes_dir = os.path.join(project_root, "backend", "indexes")
+        self.collections: Dict[str, Collection] = {}
+
+        # The legacy knowledge_base keeps its historical cache paths as the "default" collection
+        self.collections[DEFAULT_COLLECTION] = Collection(
+            DEFAULT_COLLECTION,
+            self.knowledge_dir,
+            os.path.join(project_root, "backend", "faiss_index.bin"),
+            os.path.join(project_root, "backend", "metadata.pkl"),
+        )
+        self._discover_collections()
+
+        # Initialize indexes (will be fast if cache exists)
+        for name in list(self.collections):
+            self.refresh_index(collection=name)
+        self._publish_status()
 
     @property
     def model(self):
         if self._model is None:
-            from sentence_transformers import SentenceTransformer
-            print(f"Loading Embedding Model ({self.model_name})...")
-            self._model = SentenceTransformer(self.model_name)
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    print(f"Loading Embedding Model ({self.model_name})...")
+                    self._model = SentenceTransformer(self.model_name)
         return self._model
 
     @property
@@ -40,16 +256,144 @@ class RAGEngine:
             self._faiss = faiss
         return self._faiss
 
+    def _discover_collections(self):
+        """Registers every sub-directory of collections/ as a named collection."""
+        if not os.path.isdir(self.collections_dir):
+            return
+        for entry in sorted(os.listdir(self.collections_dir)):
+            if os.path.isdir(os.path.join(self.collections_dir, entry)) and COLLECTION_NAME_PATTERN.match(entry):
+                self._register_collection(entry)
+
+    def _register_collection(self, name: str) -> Collection:
+        collection = Collection(
+            name,
+            os.path.join(self.collections_dir, name),
+            os.path.join(self.indexes_dir, f"{name}.faiss"),
+            os.path.join(self.indexes_dir, f"{name}.pkl"),
+        )
+        self.collections[name] = collection
+        return collection
+
+    def get_collection(self, name: str, create: bool = False) -> Collection:
+        """Returns a collection by name. Raises ValueError for invalid names and KeyError for unknown ones."""
+        if not COLLECTION_NAME_PATTERN.match(name or ""):
+            raise ValueError(f"Invalid collection name '{name}'.")
+        if name not in self.collections:
+            if not create:
+                raise KeyError(name)
+            self._register_collection(name)
+        return self.collections[name]
+
+    def load_collection(self, name: str) -> Collection:
+        collection = self.get_collection(name)
+        if not collection.is_loaded:
+            self.refresh_index(collection=name)
+        return collection
+
+    def unload_collection(self, name: str) -> Collection:
+        collection = self.get_collection(name)
+        collection.unload()
+        print(f"--- RAG: Collection '{name}' unloaded ---")
+        self._publish_status(index_changed=True)
+        return collection
+
+    def add_status_listener(self, listener):
+        """
+        Registers a callable receiving every status snapshot. It may be called from worker threads
+        while the status lock is held, so it must be quick and must not call back into the engine.
+        """
+        self._status_listeners.append(listener)
+
+    def _publish_status(self, index_changed: bool = False):
+        with self._status_lock:
+            if index_changed:
+                self.index_version += 1
+            collections = self.list_collections()
+            self.status = {
+                "index_ready": any(c["loaded"] for c in collections),
+                "index_version": self.index_version,
+                "chunk_count": sum(c["chunk_count"] for c in collections),
+                "files_indexed": sorted(set(f for c in collections for f in c["files_indexed"])),
+                "collections": collections,
+                "indexing": {name: dict(progress) for name, progress in self.indexing.items()},
+            }
+            # Notify under the lock so snapshots from concurrent refreshes reach listeners in
+            # build order; a stale one arriving last would otherwise stick on every client
+            for listener in self._status_listeners:
+                listener(self.status)
+
+    def _report_progress(self, col: Collection, stage: str, done: int, total: int):
+        with self._status_lock:
+            self.indexing[col.name] = {"stage": stage, "done": done, "total": total}
+        self._publish_status()
+
+    def store_document(self, collection: str, tmp_path: str, sha256: str, filename: str,
+                       size: int, tags: List[str] = None) -> Dict[str, Any]:
+        """
+        Moves an uploaded PDF into the collection's content-addressed store (<sha256>.pdf) and
+        extracts its text. Byte-identical documents are recognised from the hash and left as is,
+        so they cost no extraction and no re-indexing; tags given for a duplicate are merged into
+        the existing entry. `tmp_path` must be on the same filesystem.
+        Returns the manifest entry plus `duplicate` and `tags_changed` flags.
+        """
+        col = self.get_collection(collection)
+        blob_path = os.path.join(col.knowledge_dir, f"{sha256}.pdf")
+        text_name = f"{sha256}.txt"
+        new_tags = set(t.strip().lower() for t in tags or [] if t.strip())
+
+        with col.manifest_lock:
+            manifest = col.read_manifest()
+            if text_name in manifest and os.path.exists(os.path.join(col.knowledge_dir, text_name)):
+                entry = manifest[text_name]
+                changed = False
+                if filename != entry.get("name") and filename not in entry.setdefault("aliases", []):
+                    entry["aliases"].append(filename)
+                    changed = True
+                tags_changed = not new_tags.issubset(entry.get("tags", []))
+                if tags_changed:
+                    entry["tags"] = sorted(new_tags.union(entry.get("tags", [])))
+                if changed or tags_changed:
+                    col.write_manifest(manifest)
+                return {**entry, "duplicate": True, "tags_changed": tags_changed}
+
+            # Same name with different content gets a distinct display name instead of overwriting
+            name = filename
+            if any(e.get("name") == filename for e in manifest.values()):
+                stem, ext = os.path.splitext(filename)
+                name = f"{stem} ({sha256[:8]}){ext}"
+
+            os.replace(tmp_path, blob_path)
+            if self.ingest_pdf(blob_path) is None:
+                os.remove(blob_path)
+                raise ValueError(f"No extractable text in '{filename}'.")
+
+            entry = {
+                "name": name,
+                "sha256": sha256,
+                "size": size,
+                "tags": sorted(new_tags),
+            }
+            manifest[text_name] = entry
+            col.write_manifest(manifest)
+        return {**entry, "duplicate": False, "tags_changed": bool(new_tags)}
+
+    def list_collections(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": c.name,
+                "loaded": c.is_loaded,
+                "chunk_count": len(c.chunks),
+                "files_indexed": c.files_indexed,
+            }
+            for c in list(self.collections.values())
+        ]
+
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         from pypdf import PdfReader
         try:
             reader = PdfReader(pdf_path)
-            text = ""
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-            return text
+            # Pages are separated by form feeds so the indexer can recover page numbers
+            return PAGE_BREAK.join((page.extract_text() or "") + "\n" for page in reader.pages)
         except Exception as e:
             print(f"Error reading PDF {pdf_path}: {e}")
             return ""
@@ -62,101 +406,216 @@ class RAGEngine:
             print(f"Error reading text file {text_path}: {e}")
             return ""
 
-    def _get_kb_state(self):
-        """Returns a string representing the state of the knowledge base (filenames only for stability)."""
-        if not os.path.exists(self.knowledge_dir):
+    def ingest_pdf(self, pdf_path: str) -> Optional[str]:
+        """Extracts an uploaded PDF into a .txt sibling so the text-only indexer picks it up."""
+        text = self.extract_text_from_pdf(pdf_path)
+        if not text.strip():
+            return None
+        text_path = os.path.splitext(pdf_path)[0] + ".txt"
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return text_path
+
+    def _get_kb_state(self, collection: Collection):
+        """Returns a string representing the state of a collection (filenames only for stability)."""
+        if not os.path.exists(collection.knowledge_dir):
             return "empty"
-        
+
         # Include ONLY .txt files
-        files = [f for f in os.listdir(self.knowledge_dir) if f.endswith('.txt')]
-        
+        files = [f for f in os.listdir(collection.knowledge_dir) if f.endswith('.txt')]
+
         # Using sorted filenames and sizes for a more stable state than mtime on OneDrive
         state = ""
         for f in sorted(files):
-            path = os.path.join(self.knowledge_dir, f)
+            path = os.path.join(collection.knowledge_dir, f)
             state += f"{f}_{os.path.getsize(path)}|"
         return state
 
-    def refresh_index(self, force=False):
-        """Reloads all TXT files from knowledge_base and rebuilds the FAISS index if needed."""
+    def refresh_index(self, force=False, collection: str = DEFAULT_COLLECTION):
+        """Reloads all TXT files of a collection and rebuilds its FAISS index if needed."""
+        col = self.get_collection(collection)
+        with col.build_lock:
+            previous_index = col.index
+            try:
+                self._refresh_collection(col, force)
+            finally:
+                with self._status_lock:
+                    self.indexing.pop(col.name, None)
+                self._publish_status(index_changed=col.index is not previous_index)
+
+    def _refresh_collection(self, col: Collection, force: bool):
         import pickle
-        
-        if not os.path.exists(self.knowledge_dir):
-            os.makedirs(self.knowledge_dir)
+
+        if not os.path.exists(col.knowledge_dir):
+            os.makedirs(col.knowledge_dir)
             return
 
-        current_state = self._get_kb_state()
-        
+        current_state = self._get_kb_state(col)
+
         # Try to load existing index if state hasn't changed
-        if not force and os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
+        if not force and os.path.exists(col.index_path) and os.path.exists(col.metadata_path):
             try:
-                with open(self.metadata_path, 'rb') as f:
+                with open(col.metadata_path, 'rb') as f:
                     saved_data = pickle.load(f)
-                
-                if saved_data.get("state") == current_state:
-                    print("--- RAG: Loading existing index (Instant) ---")
-                    self.index = self.faiss_lib.read_index(self.index_path)
-                    self.chunks = saved_data["chunks"]
-                    self.chunk_metadata = saved_data["chunk_metadata"]
+
+                if saved_data.get("state") == current_state and saved_data.get("format") == INDEX_FORMAT \
+                        and saved_data.get("dedup_threshold") == self.deduplicator.threshold:
+                    print(f"--- RAG: Loading existing index for '{col.name}' (Instant) ---")
+                    col.install(
+                        self.faiss_lib.read_index(col.index_path),
+                        saved_data["chunks"],
+                        saved_data["chunk_metadata"],
+                    )
                     return
             except Exception as e:
                 print(f"Index rebuild required.")
 
         # Rebuild Index...
-        print("--- RAG: Rebuilding Index ---")
+        print(f"--- RAG: Rebuilding Index for '{col.name}' ---")
         from langchain_text_splitters import RecursiveCharacterTextSplitter
         # INCREASED CHUNK SIZE TO 1000 for better context
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        
-        self.chunks = []
-        self.chunk_metadata = []
-        
+
+        chunk_metadata = []
+
         # Gather all files
-        all_files = [f for f in os.listdir(self.knowledge_dir) if f.endswith('.txt')]
+        # Sorted so the dedup representative does not depend on filesystem listing order
+        all_files = sorted(f for f in os.listdir(col.knowledge_dir) if f.endswith('.txt'))
         if not all_files:
+            col.unload()
             return
 
+        # Content-addressed documents are cited under their uploaded name
+        manifest = col.read_manifest()
+
         all_text_chunks = []
-        for file_name in all_files:
-            file_path = os.path.join(self.knowledge_dir, file_name)
+        for file_number, file_name in enumerate(all_files):
+            file_path = os.path.join(col.knowledge_dir, file_name)
             print(f"Syncing: {file_name}...")
-            
+            self._report_progress(col, "syncing", file_number, len(all_files))
+
             full_text = self.read_text_file(file_path)
-            
+
             if not full_text.strip(): continue
 
-            file_chunks = text_splitter.split_text(full_text)
-            for i, chunk in enumerate(file_chunks):
-                all_text_chunks.append(chunk)
-                self.chunk_metadata.append({
-                    "source": file_name,
-                    "chunk_id": i,
-                    "content": chunk.lower() # For search optimization
-                })
+            # Chunks never straddle a page break so each one carries a single page number
+            chunk_id = 0
+            for page_number, page_text in enumerate(full_text.split(PAGE_BREAK), start=1):
+                if not page_text.strip(): continue
+                for chunk in text_splitter.split_text(page_text):
+                    all_text_chunks.append(chunk)
+                    chunk_metadata.append({
+                        "source": manifest.get(file_name, {}).get("name", file_name),
+                        "chunk_id": chunk_id,
+                        "page": page_number,
+                        "content": chunk.lower() # For search optimization
+                    })
+                    chunk_id += 1
 
-        if not all_text_chunks: return
+        if not all_text_chunks:
+            col.unload()
+            return
+
+        all_text_chunks, chunk_metadata = self._collapse_near_duplicates(all_text_chunks, chunk_metadata)
 
         print(f"Encoding {len(all_text_chunks)} chunks...")
-        embeddings = self.model.encode(all_text_chunks, show_progress_bar=True)
-        
-        self.index = self.faiss_lib.IndexFlatL2(embeddings.shape[1])
-        self.index.add(np.array(embeddings).astype('float32'))
-        self.chunks = all_text_chunks
-
-        self.faiss_lib.write_index(self.index, self.index_path)
-        with open(self.metadata_path, 'wb') as f:
-            pickle.dump({"state": current_state, "chunks": self.chunks, "chunk_metadata": self.chunk_metadata}, f)
+        # Encode in slices so progress can be pushed to status listeners
+        batches = []
+        for start in range(0, len(all_text_chunks), ENCODE_PROGRESS_STEP):
+            self._report_progress(col, "encoding", start, len(all_text_chunks))
+            batches.append(self.model.encode(all_text_chunks[start:start + ENCODE_PROGRESS_STEP]))
+        embeddings = np.vstack(batches)
+
+        index = self.faiss_lib.IndexFlatL2(embeddings.shape[1])
+        index.add(np.array(embeddings).astype('float32'))
+        col.install(index, all_text_chunks, chunk_metadata)
+
+        os.makedirs(os.path.dirname(col.index_path), exist_ok=True)
+        self.faiss_lib.write_index(col.index, col.index_path)
+        with open(col.metadata_path, 'wb') as f:
+            pickle.dump({"state": current_state, "format": INDEX_FORMAT,
+                         "dedup_threshold": self.deduplicator.threshold, "chunks": col.chunks, "chunk_metadata": col.chunk_metadata}, f)
         print(f"--- RAG: Index Persistent ---")
 
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        if self.index is None or not self.chunks:
-            return []
+    def _collapse_near_duplicates(self, chunks: List[str], chunk_metadata: List[Dict[str, Any]]):
+        """Keeps one chunk per near-duplicate group; its metadata lists every original location."""
+        canonical = self.deduplicator.group([m["content"] for m in chunk_metadata])
 
-        # 1. Semantic Search (Wide fetch)
-        query_embedding = self.model.encode([query])
-        distances, indices = self.index.search(np.array(query_embedding).astype('float32'), 20)
-        
-        # 2. Hybrid Re-scoring
+        kept_chunks, kept_metadata, slot = [], [], {}
+        for i, rep in enumerate(canonical):
+            ref = {k: chunk_metadata[i][k] for k in ("source", "chunk_id", "page")}
+            if rep == i:
+                slot[i] = len(kept_metadata)
+                kept_chunks.append(chunks[i])
+                kept_metadata.append({**chunk_metadata[i], "sources": [ref]})
+            else:
+                kept_metadata[slot[rep]]["sources"].append(ref)
+
+        if len(kept_chunks) < len(chunks):
+            print(f"Deduplicated {len(chunks)} chunks into {len(kept_chunks)}.")
+        return kept_chunks, kept_metadata
+
+    def _resolve_collections(self, names: Optional[List[str]]) -> List[Collection]:
+        """
+        None targets every loaded collection. Explicit names must already be loaded: a rebuild
+        here would hold a bounded search slot for its whole duration, so callers load first.
+        Raises CollectionNotLoadedError for a named collection that has documents but no index
+        (e.g. unloaded after the caller loaded it); empty collections simply contribute nothing.
+        """
+        if names is None:
+            return [c for c in list(self.collections.values()) if c.is_loaded]
+        targets = []
+        for col in (self.get_collection(name) for name in dict.fromkeys(names)):
+            if col.is_loaded:
+                targets.append(col)
+            elif col.has_documents:
+                raise CollectionNotLoadedError(col.name)
+        return targets
+
+    def _search_index(self, index, row_ids: Optional[np.ndarray], query_embedding: np.ndarray, k: int):
+        """Runs the FAISS search, restricting it to the filtered rows through an ID selector."""
+        if row_ids is None:
+            return index.search(query_embedding, k)
+        if len(row_ids) == 0:
+            return None
+
+        # Never ask for more neighbours than the subset holds: nothing is fetched to be discarded
+        faiss = self.faiss_lib
+        selector = faiss.IDSelectorBatch(len(row_ids), faiss.swig_ptr(row_ids))
+        params = faiss.SearchParameters(sel=selector)
+        return index.search(query_embedding, min(k, len(row_ids)), params=params)
+
+    async def _run_bounded(self, fn, *args, **kwargs):
+        """Runs a blocking retrieval call in the search pool, rejecting work once the queue is full."""
+        if self._search_inflight >= self.search_workers + self.search_queue_limit:
+            raise SearchOverloadedError(self.search_retry_after)
+        # Only the event loop thread touches the counter, so no lock is needed
+        self._search_inflight += 1
+        loop = asyncio.get_running_loop()
+        future = self._search_executor.submit(functools.partial(fn, *args, **kwargs))
+        # The slot is released when the pool work really ends (or is cancelled before starting),
+        # not when the awaiting request goes away: a running thread cannot be interrupted
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release_search_slot))
+        return await asyncio.wrap_future(future)
+
+    def _release_search_slot(self):
+        self._search_inflight -= 1
+
+    async def asearch(self, query: str, **kwargs) -> List[Dict[str, Any]]:
+        """Async variant of `search` that keeps encoding and FAISS work off the event loop."""
+        return await self._run_bounded(self.search, query, **kwargs)
+
+    async def asearch_batch(self, queries: List[str], **kwargs):
+        """Async variant of `search_batch`; the whole batch occupies a single pool slot."""
+        return await self._run_bounded(self.search_batch, queries, **kwargs)
+
+    def _search_targets(self, collections: Optional[List[str]]) -> List[Collection]:
+        return [c for c in self._resolve_collections(collections) if c.is_loaded and c.chunks]
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        return np.array(self.model.encode(queries)).astype('float32')
+
+    def _boost_terms(self, query: str) -> List[str]:
         # Add technical mappings to help French -> English RAG
         terms_to_boost = {
             "génie": ["engineering", "engineer"],
@@ -166,44 +625,156 @@ class RAGEngine:
             "frais": ["fees", "tuition", "mad"],
             "prix": ["fees", "tuition"]
         }
-        
+
         query_lower = query.lower()
         query_terms = [t.lower() for t in query.split() if len(t) > 2]
-        
+
         # Add mapped terms to query_terms for boosting
         extra_boost_terms = []
         for key, synonyms in terms_to_boost.items():
             if key in query_lower:
                 extra_boost_terms.extend(synonyms)
-        
-        all_boost_terms = list(set(query_terms + extra_boost_terms))
-        
-        scored_results = []
-        for i, idx in enumerate(indices[0]):
-            if idx == -1 or idx >= len(self.chunk_metadata): continue
-            
-            metadata = self.chunk_metadata[idx]
-            content = metadata["content"].lower()
-            
-            # Distance score
-            semantic_score = 1.0 / (1.0 + distances[0][i])
-            
-            # Keyword BOOST
-            match_count = 0
-            for term in all_boost_terms:
-                if term in content:
-                    match_count += 1
-            
-            # Heavy penalty for the encyclopedia noise if it doesn't match main terms
-            is_encyclopedia = "encyclopedia" in metadata["source"].lower()
-            if is_encyclopedia and match_count < 1:
-                semantic_score *= 0.1 # Collapse score for encyclopedia junk
-
-            final_score = semantic_score + (match_count * 2.0) # Strong boost
-            scored_results.append((final_score, metadata))
-        
+
+        return list(set(query_terms + extra_boost_terms))
+
+    def _search_embeddings(self, targets: List[Collection], queries: List[str], embeddings: np.ndarray,
+                           search_filter: Optional[SearchFilter], profiles: List[Dict[str, Any]],
+                           fetch_k: int = 20) -> List[List[Dict[str, Any]]]:
+        """Runs one FAISS search per collection for the whole query matrix, then re-scores per query."""
+        # 1. Semantic Search (Wide fetch)
+        collection_hits = []
+        for col in targets:
+            index, chunk_metadata, row_ids, ref_filter = col.snapshot(search_filter)
+            if index is None: continue
+            hits = self._search_index(index, row_ids, embeddings, fetch_k)
+            if hits is None: continue
+            collection_hits.append((col.name, chunk_metadata, ref_filter, hits))
+
+        # 2. Hybrid Re-scoring
+        all_results = []
+        for q, (query, profile) in enumerate(zip(queries, profiles)):
+            all_boost_terms = self._boost_terms(query)
+
+            scored_results = []
+            for collection_name, chunk_metadata, ref_filter, (distances, indices) in collection_hits:
+                for i, idx in enumerate(indices[q]):
+                    if idx == -1 or idx >= len(chunk_metadata): continue
+
+                    metadata = chunk_metadata[idx]
+                    content = metadata["content"].lower()
+
+                    # Distance score
+                    semantic_score = 1.0 / (1.0 + distances[q][i])
+
+                    # Keyword BOOST
+                    match_count = 0
+                    for term in all_boost_terms:
+                        if term in content:
+                            match_count += 1
+
+                    # Heavy penalty for the encyclopedia noise if it doesn't match main terms
+                    is_encyclopedia = "encyclopedia" in metadata["source"].lower()
+                    if is_encyclopedia and match_count < 1:
+                        semantic_score *= 0.1 # Collapse score for encyclopedia junk
+
+                    final_score = semantic_score + (match_count * 2.0) # Strong boost
+                    result = {**metadata, "collection": collection_name}
+                    if ref_filter is not None and "sources" in metadata:
+                        # Cite only the origins that satisfied the filter, not the representative
+                        refs = [ref for ref in metadata["sources"] if ref_filter(ref)]
+                        result.update(refs[0], sources=refs)
+                    scored_results.append((final_score, result))
+
+            all_results.append(self._rank(scored_results, profile))
+        return all_results
+
+    def _rank(self, scored_results: List[tuple], profile: Dict[str, Any]) -> List[Dict[str, Any]]:
         scored_results.sort(key=lambda x: x[0], reverse=True)
-        return [res[1] for res in scored_results[:top_k]]
+        results = scored_results[:profile.get("top_k", 5)]
+
+        # Score-gap cut: once the minimum depth is reached, stop at the first sharp relevance drop
+        score_gap = profile.get("score_gap")
+        if score_gap is not None:
+            for i in range(max(profile.get("min_k", 1), 1), len(results)):
+                if results[i - 1][0] - results[i][0] >= score_gap:
+                    results = results[:i]
+                    break
+
+        for score, metadata in results:
+            metadata["score"] = round(float(score), 4)
+        return [res[1] for res in results]
+
+    def search(self, query: str, top_k: int = 5, collections: Optional[List[str]] = None,
+               search_filter: Optional[SearchFilter] = None, fetch_k: int = 20, min_k: int = 1,
+               score_gap: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Hybrid semantic + keyword search. `fetch_k` neighbours are scanned per collection and at
+        most `top_k` returned; with `score_gap`, the list is cut at the first drop of at least that
+        size after `min_k` results. Each result carries its `score` for downstream stages.
+        Named `collections` must be loaded (see `load_collection`), otherwise
+        CollectionNotLoadedError is raised.
+        """
+        targets = self._search_targets(collections)
+        if not targets:
+            return []
+
+        profile = {"top_k": top_k, "min_k": min_k, "score_gap": score_gap}
+        return self._search_embeddings(targets, [query], self.encode_queries([query]), search_filter, [profile], fetch_k)[0]
+
+    def search_batch(self, queries: List[str], collections: Optional[List[str]] = None,
+                     search_filter: Optional[SearchFilter] = None, profiles: Optional[List[Dict[str, Any]]] = None,
+                     near_duplicate_threshold: float = 0.97):
+        """
+        Searches many queries with one encoder batch and one FAISS search per collection.
+
+        Identical queries (modulo case, punctuation and spacing) and near-identical ones (cosine
+        similarity >= `near_duplicate_threshold` with the same profile) are collapsed. Returns
+        `(canonical, results)`: `canonical[i]` is the index of the query whose retrieval answers
+        query i, and `results[i]` its chunks (shared with that representative).
+        """
+        profiles = profiles or [{} for _ in queries]
+        canonical = list(range(len(queries)))
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+
+        targets = self._search_targets(collections)
+        if not queries or not targets:
+            return canonical, results
+
+        # 1. Exact duplicates never reach the encoder
+        first_seen: Dict[tuple, int] = {}
+        for i, query in enumerate(queries):
+            key = (" ".join(re.findall(r"\w+", query.lower())), repr(sorted(profiles[i].items())))
+            canonical[i] = first_seen.setdefault(key, i)
+        unique = [i for i in range(len(queries)) if canonical[i] == i]
+
+        # 2. Near duplicates: greedy clustering on normalised embeddings
+        embeddings = self.encode_queries([queries[i] for i in unique])
+        normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        similarity = normalized @ normalized.T
+        representatives = []
+        for u, i in enumerate(unique):
+            for r in representatives:
+                if similarity[u, r] >= near_duplicate_threshold and profiles[unique[r]] == profiles[i]:
+                    canonical[i] = unique[r]
+                    break
+            else:
+                representatives.append(u)
+        for i in range(len(queries)):
+            canonical[i] = canonical[canonical[i]]
+
+        # 3. One batched search for the representatives only
+        rep_ids = [unique[u] for u in representatives]
+        rep_results = self._search_embeddings(
+            targets,
+            [queries[i] for i in rep_ids],
+            embeddings[representatives],
+            search_filter,
+            [profiles[i] for i in rep_ids],
+        )
+        by_rep = dict(zip(rep_ids, rep_results))
+        for i in range(len(queries)):
+            results[i] = by_rep[canonical[i]]
+        return canonical, results
 
 # Singleton instance
 rag_engine = RAGEngine()
@@ -28,10 +28,18 @@ interface QueryResponse {
   sources: string[];
 }
 
+interface IndexingProgress {
+  stage: string;
+  done: number;
+  total: number;
+}
+
 interface Status {
   index_ready: boolean;
+  index_version: number;
   chunk_count: number;
   files_indexed: string[];
+  indexing: Record<string, IndexingProgress>;
 }
 
 function App() {
@@ -44,19 +52,16 @@ function App() {
   const scrollRef = useRef<HTMLDivElement>(null);
 
   useEffect(() => {
-    fetchStatus();
-    const interval = setInterval(fetchStatus, 5000); // Poll status
-    return () => clearInterval(interval);
+    // The backend pushes a snapshot on connect and on every index change
+    const events = new EventSource(`${API_BASE}/events`);
+    events.addEventListener('status', (e) => {
+      setStatus(JSON.parse((e as MessageEvent).data));
+    });
+    events.onerror = () => console.error("Status stream interrupted, reconnecting...");
+    return () => events.close();
   }, []);
 
-  const fetchStatus = async () => {
-    try {
-      const res = await axios.get(`${API_BASE}/status`);
-      setStatus(res.data);
-    } catch (err) {
-      console.error("Failed to fetch status", err);
-    }
-  };
+  const indexing = status ? Object.values(status.indexing ?? {})[0] : undefined;
 
   const handleQuery = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -90,7 +95,6 @@ function App() {
 
     try {
       await axios.post(`${API_BASE}/upload`, formData);
-      await fetchStatus();
     } catch (err) {
       console.error("Upload failed", err);
     } finally {
@@ -135,7 +139,11 @@ function App() {
           >
             <div className="flex items-center gap-2 text-zinc-500 bg-zinc-50 px-3 py-1.5 rounded-full border border-zinc-100">
               <div className={`w-1.5 h-1.5 rounded-full ${status?.index_ready ? 'bg-zinc-900' : 'bg-zinc-300'}`} />
-              <span className="font-medium text-xs tracking-wide">{status?.index_ready ? 'SYSTEM ACTIVE' : 'OFFLINE'}</span>
+              <span className="font-medium text-xs tracking-wide">
+                {indexing
+                  ? `INDEXING ${indexing.done}/${indexing.total}`
+                  : status?.index_ready ? 'SYSTEM ACTIVE' : 'OFFLINE'}
+              </span>
             </div>
 
             <label className="cursor-pointer group">